@@ -1,10 +1,67 @@
-import copy
 import inspect
+import keyword
+import threading
+import weakref
 from functools import wraps
-from typing import Any, Dict, List, Optional
+from operator import methodcaller
+from types import CodeType
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+_Param = Tuple[str, Any, bool]
+_Leaf = Tuple[int, int]
+_Step = Tuple[int, Tuple[int, ...]]
+
+_UNSET = object()
+
+_VAR_KINDS = (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)
+
+
+def _fast_params(fun) -> Tuple[_Param, ...]:
+    if fun is object.__init__:
+        return ()
+    if not inspect.isfunction(fun) or hasattr(fun, "__wrapped__") or hasattr(fun, "__signature__"):
+        parameters = inspect.signature(fun).parameters.values()
+        return tuple(
+            (p.name, p.annotation, p.kind is inspect.Parameter.KEYWORD_ONLY)
+            for p in parameters
+            if p.kind not in _VAR_KINDS
+        )
+    code = fun.__code__
+    annotations = fun.__annotations__
+    names = code.co_varnames[: code.co_argcount + code.co_kwonlyargcount]
+    return tuple(
+        (name, annotations.get(name, inspect.Parameter.empty), index >= code.co_argcount)
+        for index, name in enumerate(names)
+    )
+
+
+class _ClassPlan:
+    __slots__ = ("params", "codes")
+
+    def __init__(self, init: Any) -> None:
+        self.params = _fast_params(init)
+        self.codes: Dict[str, CodeType] = {}
+
+
+_PLAN_CACHE: "weakref.WeakKeyDictionary[Any, _ClassPlan]" = weakref.WeakKeyDictionary()
+
+
+def _get_class_plan(cls_: Any) -> _ClassPlan:
+    # Keyed by __init__ rather than cls_, so a replaced __init__ gets a fresh plan. Inits that cannot be
+    # weakly referenced or hashed (builtins, bound methods of callable instances) are planned uncached.
+    init = cls_.__init__
+    try:
+        plan = _PLAN_CACHE.get(init)
+        if plan is None:
+            plan = _PLAN_CACHE[init] = _ClassPlan(init)
+    except TypeError:
+        plan = _ClassPlan(init)
+    return plan
 
 
 class Call:
+    __slots__ = ("method", "args", "kwargs")
+
     def __init__(self, method: str, args: Optional[List[str]] = None, kwargs: Optional[Dict[str, Any]] = None) -> None:
         self.method = method
         self.args = args if args else []
@@ -12,7 +69,7 @@ class Call:
 
 
 class DIConf:
-    __slots__ = ("cls_", "name", "args", "kwargs", "calls", "attrs", "cache", "cached")
+    __slots__ = ("cls_", "name", "args", "kwargs", "calls", "attrs", "cache")
 
     def __init__(
         self,
@@ -29,76 +86,212 @@ class DIConf:
         self.calls = calls if calls else []
         self.attrs = attrs if attrs else {}
         self.cache = cache
-        self.cached = None
 
 
-class DIParam:
-    def __init__(self, conf: DIConf, param: inspect.Parameter) -> None:
-        self.conf = conf
-        self.param = param
+def _is_attr_name(name: str) -> bool:
+    return name.isidentifier() and not keyword.iskeyword(name)
+
+
+def _compile_factory(conf: DIConf, names: Tuple[str, ...]) -> Callable[..., Any]:
+    namespace: Dict[str, Any] = {"_cls": conf.cls_}
+    params = [f"dep_{i}" for i in range(len(names))]
+
+    init_args = [f"{name}=dep_{i}" for i, name in enumerate(names)]
+    if conf.args:
+        namespace["_args"] = tuple(conf.args)
+        init_args.insert(0, "*_args")
+    if conf.kwargs:
+        namespace["_kwargs"] = dict(conf.kwargs)
+        init_args.append("**_kwargs")
+    lines = [f"    obj = _cls({', '.join(init_args)})"]
+
+    for i, (attr, value) in enumerate(conf.attrs.items()):
+        namespace[f"_attr_{i}"] = value
+        if _is_attr_name(attr):
+            lines.append(f"    obj.{attr} = _attr_{i}")
+        else:
+            namespace[f"_attr_name_{i}"] = attr
+            lines.append(f"    setattr(obj, _attr_name_{i}, _attr_{i})")
+
+    for i, call in enumerate(conf.calls):
+        if inspect.iscoroutinefunction(getattr(conf.cls_, call.method, None)):
+            raise TypeError(f"Call {conf.cls_.__name__}.{call.method} is a coroutine function, calls must be sync")
+        if _is_attr_name(call.method) and not call.args and not call.kwargs:
+            lines.append(f"    obj.{call.method}()")
+        else:
+            namespace[f"_call_{i}"] = methodcaller(call.method, *call.args, **call.kwargs)
+            lines.append(f"    _call_{i}(obj)")
+
+    source = "\n".join([f"def _factory({', '.join(params)}):", *lines, "    return obj"])
+    codes = _get_class_plan(conf.cls_).codes
+    code = codes.get(source)
+    if code is None:
+        code = codes[source] = compile(source, "<di>", "exec")
+    exec(code, namespace)
+    return namespace["_factory"]
 
 
 class Container:
-    def __init__(self, config: Dict[str, DIConf]) -> None:
+    def __init__(self, config: Dict[Union[str, type], DIConf]) -> None:
         self.config = config
+        self._idx = {name: index for index, name in enumerate(config)}
+        self._class_names: Dict[str, Optional[int]] = {}
+        for index, key in enumerate(config):
+            if isinstance(key, type):
+                for name in {key.__name__, key.__qualname__}:
+                    self._class_names[name] = None if name in self._class_names else index
+
+        confs = tuple(config.values())
+        children = tuple(self._compile_children(conf) for conf in confs)
+        self._factories = tuple(
+            _compile_factory(conf, tuple(name for name, _ in params)) for conf, params in zip(confs, children)
+        )
+        slots: List[Optional[int]] = [None] * len(confs)
+        cached = [index for index, conf in enumerate(confs) if conf.cache]
+        for slot, index in enumerate(cached):
+            slots[index] = slot
+        self._slots = tuple(slots)
+        self._cache_slots: List[Any] = [_UNSET] * len(cached)
+        self._locks = tuple(threading.Lock() for _ in cached)
+        self._builders: List[Optional[int]] = [None] * len(cached)
+
+        self._children = tuple(tuple(index for _, index in params) for params in children)
+        self._check_cycles()
+        self._leaves: List[Optional[Tuple[_Leaf, ...]]] = [None] * len(confs)
+        self._steps: List[Optional[Tuple[_Step, ...]]] = [None] * len(confs)
+
+    def _compile_children(self, conf: DIConf) -> List[Tuple[str, int]]:
+        params = _get_class_plan(conf.cls_).params
+        return self._get_configurable(self._get_params_to_resolve(params, conf.kwargs))
+
+    def _names(self) -> Tuple[str, ...]:
+        return tuple(getattr(key, "__name__", key) for key in self.config)
+
+    def _check_cycles(self) -> None:
+        names = self._names()
+        checked = set()
 
-    def _build_dependency(self, param: DIParam):
-        to_resolve = self._get_params_to_resolve(fun=param.conf.cls_.__init__)
-        params_to_resolve = self._get_configurable(to_resolve)
-        cached = self._get_cached(params_to_resolve)
+        def visit(node: int, path: Tuple[int, ...]) -> None:
+            if node in path:
+                cycle = " -> ".join(names[i] for i in path[path.index(node) :] + (node,))
+                raise ValueError(f"Circular dependency: {cycle}")
+            if node in checked:
+                return
+            for child in self._children[node]:
+                visit(child, path + (node,))
+            checked.add(node)
 
-        resolved = {}
-        if params_to_resolve:
-            resolved = {
-                p.param.name: self._build_dependency(p) for p in params_to_resolve if p.param.name not in cached
-            }
+        for index in range(len(names)):
+            visit(index, ())
 
-        dependency = param.conf.cls_(*param.conf.args, **resolved | cached | param.conf.kwargs)
+    def _compile_steps(self, index: int) -> Tuple[Tuple[_Leaf, ...], Tuple[_Step, ...]]:
+        # Post-order over the transient subtree. Cached children become leaves that are fetched from their
+        # slots before any step runs, so instance positions are leaves first, then steps.
+        leaves: Dict[int, int] = {}
+        steps: List[Tuple[int, List[Tuple[bool, int]]]] = []
 
-        for attr, value in param.conf.attrs.items():
-            setattr(dependency, attr, value)
+        def visit(node: int) -> int:
+            refs = []
+            for child in self._children[node]:
+                if self._slots[child] is not None:
+                    refs.append((True, leaves.setdefault(child, len(leaves))))
+                else:
+                    refs.append((False, visit(child)))
+            steps.append((node, refs))
+            return len(steps) - 1
 
-        for call in param.conf.calls:
-            getattr(dependency, call.method)(*call.args, **call.kwargs)
+        visit(index)
+        return (
+            tuple((leaf, self._slots[leaf]) for leaf in leaves),
+            tuple((node, tuple(i if is_leaf else len(leaves) + i for is_leaf, i in refs)) for node, refs in steps),
+        )
 
-        if param.conf.cache and not param.conf.cached:
-            param.conf.cached = dependency
+    def _build_dependency(self, index: int):
+        slot = self._slots[index]
+        if slot is None:
+            return self._construct(index)
+
+        cache_slots = self._cache_slots
+        dependency = cache_slots[slot]
+        if dependency is _UNSET:
+            thread = threading.get_ident()
+            if self._builders[slot] == thread:
+                raise ValueError(f"Circular dependency: {self._names()[index]} is required while being built")
+            with self._locks[slot]:
+                dependency = cache_slots[slot]
+                if dependency is _UNSET:
+                    self._builders[slot] = thread
+                    try:
+                        dependency = cache_slots[slot] = self._construct(index)
+                    finally:
+                        self._builders[slot] = None
 
         return dependency
 
-    def _get_params_to_resolve(self, fun, args=None, kwargs=None) -> List[inspect.Parameter]:
-        args_ = list(copy.deepcopy(args)) if args else []
-        kwargs_ = copy.deepcopy(kwargs) if kwargs else {}
+    def _construct(self, index: int):
+        steps = self._steps[index]
+        if steps is None:
+            self._leaves[index], steps = self._compile_steps(index)
+            self._steps[index] = steps
 
-        signature = inspect.signature(fun)
-        params_ = {k: v for k, v in signature.parameters.items()}
+        factories, cache_slots = self._factories, self._cache_slots
+        instances = [
+            cached if (cached := cache_slots[leaf_slot]) is not _UNSET else self._build_dependency(leaf)
+            for leaf, leaf_slot in self._leaves[index]
+        ]
+        append = instances.append
+        for step, children in steps:
+            append(factories[step](*[instances[i] for i in children]))
 
-        for param in signature.parameters.keys():
-            if args_:
-                args_.pop(0)
-                params_.pop(param)
-            elif kwargs_:
-                if param in kwargs_:
-                    kwargs_.pop(param)
-                    params_.pop(param)
+        return instances[-1]
 
-        return list(params_.values())
+    def _get_params_to_resolve(self, params: Tuple[_Param, ...], kwargs: Dict[str, Any]) -> List[_Param]:
+        return [param for param in params if param[0] not in kwargs]
 
     def use_container(self, fun):
+        configurable = tuple(
+            (position, name, index, keyword_only)
+            for position, (name, annotation, keyword_only) in enumerate(_fast_params(fun))
+            if (index := self._get_index(annotation)) is not None
+        )
+
+        build = self._build_dependency
+
+        def resolve(args, kwargs):
+            n_pos = len(args)
+            for position, name, index, keyword_only in configurable:
+                if (keyword_only or position >= n_pos) and name not in kwargs:
+                    kwargs[name] = build(index)
+            return kwargs
+
+        if inspect.iscoroutinefunction(fun):
+
+            @wraps(fun)
+            async def async_wrapped(*args, **kwargs):
+                return await fun(*args, **resolve(args, kwargs))
+
+            return async_wrapped
+
         @wraps(fun)
         def wrapped(*args, **kwargs):
-            to_resolve = self._get_params_to_resolve(fun, args, kwargs)
-            params_to_resolve = self._get_configurable(to_resolve)
-            cached = self._get_cached(params_to_resolve)
-            resolved = {
-                p.param.name: self._build_dependency(p) for p in params_to_resolve if p.param.name not in cached
-            }
-            return fun(*args, **kwargs | resolved | cached)
+            return fun(*args, **resolve(args, kwargs))
 
         return wrapped
 
-    def _get_configurable(self, parameters: List[inspect.Parameter]) -> List[DIParam]:
-        return [DIParam(conf, param) for param in parameters if (conf := self.config.get(param.annotation.__name__))]
+    def _get_configurable(self, parameters: List[_Param]) -> List[Tuple[str, int]]:
+        return [
+            (name, index) for name, annotation, _ in parameters if (index := self._get_index(annotation)) is not None
+        ]
 
-    def _get_cached(self, params: List[DIParam]) -> List[DIParam]:
-        return {p.param.name: p.conf.cached for p in params if p.conf.cache and p.conf.cached}
+    def _get_index(self, annotation: Any) -> Optional[int]:
+        try:
+            index = self._idx.get(annotation)
+        except TypeError:
+            index = None
+        if index is None:
+            index = self._idx.get(getattr(annotation, "__name__", None))
+        if index is None and isinstance(annotation, str) and annotation in self._class_names:
+            index = self._class_names[annotation]
+            if index is None:
+                raise ValueError(f"Ambiguous annotation {annotation!r}: several class keys have this name")
+        return index
@@ -0,0 +1,276 @@
+import threading
+import time
+import types
+from dataclasses import dataclass
+from typing import Annotated
+from unittest import mock
+
+import pytest
+
+from container import Call, Container, DIConf
+
+
+class Repo:
+    pass
+
+
+class Service:
+    def __init__(self, repo: Repo) -> None:
+        self.repo = repo
+
+
+def test_resolves_dependency_graph():
+    container = Container({"Repo": DIConf(cls_=Repo), "Service": DIConf(cls_=Service)})
+
+    @container.use_container
+    def handle(service: Service) -> Service:
+        return service
+
+    first, second = handle(), handle()
+    assert isinstance(first.repo, Repo)
+    assert first is not second and first.repo is not second.repo
+
+
+def test_circular_transient_dependency_fails_on_creation():
+    class A:
+        def __init__(self, b: "B") -> None:
+            pass
+
+    class B:
+        def __init__(self, a: A) -> None:
+            pass
+
+    with pytest.raises(ValueError, match="Circular dependency: A -> B -> A"):
+        Container({"A": DIConf(cls_=A), "B": DIConf(cls_=B)})
+
+
+def test_wide_transient_graph_is_not_expanded_on_creation():
+    config = {"Level0": DIConf(cls_=Repo)}
+    for level in range(1, 40):
+        below = config[f"Level{level - 1}"].cls_
+
+        def __init__(self, left: below, right: below) -> None:
+            pass
+
+        config[f"Level{level}"] = DIConf(cls_=type(f"Level{level}", (), {"__init__": __init__}))
+
+    Container(config)
+
+
+def test_cached_instance_belongs_to_container():
+    repo_conf = DIConf(cls_=Repo, cache=True)
+    first, second = Container({"Repo": repo_conf}), Container({"Repo": repo_conf})
+
+    def get_repo(repo: Repo) -> Repo:
+        return repo
+
+    assert first.use_container(get_repo)() is first.use_container(get_repo)()
+    assert first.use_container(get_repo)() is not second.use_container(get_repo)()
+    assert not hasattr(repo_conf, "cached")
+
+
+def test_class_keys_distinguish_classes_with_same_name():
+    first, second = types.ModuleType("first"), types.ModuleType("second")
+    exec("class Client:\n    pass", first.__dict__)
+    exec("class Client:\n    pass", second.__dict__)
+    container = Container({first.Client: DIConf(cls_=first.Client), second.Client: DIConf(cls_=second.Client)})
+
+    @container.use_container
+    def handle(a: first.Client, b: second.Client):
+        return a, b
+
+    a, b = handle()
+    assert type(a) is first.Client and type(b) is second.Client
+
+
+def test_string_keys_match_class_and_string_annotations():
+    container = Container({"Repo": DIConf(cls_=Repo)})
+
+    @container.use_container
+    def handle(a: Repo, b: "Repo"):
+        return a, b
+
+    a, b = handle()
+    assert isinstance(a, Repo) and isinstance(b, Repo)
+
+
+def test_unhashable_annotation_is_ignored():
+    container = Container({"Repo": DIConf(cls_=Repo)})
+
+    @container.use_container
+    def handle(x: Annotated[int, []], repo: Repo):
+        return x, repo
+
+    x, repo = handle(1)
+    assert x == 1 and isinstance(repo, Repo)
+
+
+def test_coroutine_call_is_rejected_on_creation():
+    class Client:
+        async def connect(self) -> None:
+            pass
+
+    with pytest.raises(TypeError, match="Client.connect is a coroutine function"):
+        Container({"Client": DIConf(cls_=Client, calls=[Call(method="connect")])})
+
+
+def test_keyword_only_dependency_after_var_positional():
+    container = Container({"Repo": DIConf(cls_=Repo)})
+
+    @container.use_container
+    def collect(*args, repo: Repo):
+        return args, repo
+
+    @container.use_container
+    def collect_rest(first, *rest, repo: Repo):
+        return first, rest, repo
+
+    args, repo = collect(1)
+    assert args == (1,) and isinstance(repo, Repo)
+    first, rest, repo = collect_rest(1, 2)
+    assert (first, rest) == (1, (2,)) and isinstance(repo, Repo)
+
+
+def test_falsy_and_none_instances_are_cached():
+    built = []
+
+    class Empty:
+        def __init__(self) -> None:
+            built.append(self)
+
+        def __bool__(self) -> bool:
+            return False
+
+    def make_nothing() -> None:
+        built.append(None)
+
+    class Nothing:
+        pass
+
+    container = Container({"Empty": DIConf(cls_=Empty, cache=True), "Nothing": DIConf(cls_=make_nothing, cache=True)})
+
+    @container.use_container
+    def handle(empty: Empty, nothing: Nothing):
+        return empty, nothing
+
+    assert handle() == handle()
+    assert len(built) == 2
+
+
+def test_circular_dependency_through_cached_configs_fails_on_creation():
+    class A:
+        def __init__(self, b: "B") -> None:
+            pass
+
+    class B:
+        def __init__(self, a: A) -> None:
+            pass
+
+    with pytest.raises(ValueError, match="Circular dependency"):
+        Container({"A": DIConf(cls_=A, cache=True), "B": DIConf(cls_=B, cache=True)})
+
+
+def test_cached_dependency_is_built_once_across_threads():
+    built = []
+
+    class Slow:
+        def __init__(self) -> None:
+            built.append(self)
+            time.sleep(0.05)
+
+    container = Container({"Slow": DIConf(cls_=Slow, cache=True)})
+
+    @container.use_container
+    def handle(slow: Slow) -> Slow:
+        return slow
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(handle())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(built) == 1
+    assert all(result is built[0] for result in results)
+
+
+def test_replaced_init_is_replanned():
+    class Client:
+        def __init__(self) -> None:
+            self.repo = None
+
+    def new_init(self, repo: Repo) -> None:
+        self.repo = repo
+
+    Container({"Repo": DIConf(cls_=Repo), "Client": DIConf(cls_=Client)})
+    with mock.patch.object(Client, "__init__", new_init):
+        container = Container({"Repo": DIConf(cls_=Repo), "Client": DIConf(cls_=Client)})
+
+        @container.use_container
+        def handle(client: Client) -> Client:
+            return client
+
+        assert isinstance(handle().repo, Repo)
+
+
+def test_callable_instances_can_be_factories():
+    @dataclass
+    class Factory:
+        built: list
+
+        def __call__(self) -> Repo:
+            return Repo()
+
+    class SlottedFactory:
+        __slots__ = ()
+
+        def __call__(self) -> Service:
+            return Service(Repo())
+
+    container = Container({"Repo": DIConf(cls_=Factory([])), "Service": DIConf(cls_=SlottedFactory())})
+
+    @container.use_container
+    def handle(repo: Repo, service: Service):
+        return repo, service
+
+    repo, service = handle()
+    assert isinstance(repo, Repo) and isinstance(service, Service)
+
+
+def test_runtime_cycle_through_cached_config_raises():
+    class Registry:
+        def __init__(self) -> None:
+            lookup()
+
+    container = Container({"Registry": DIConf(cls_=Registry, cache=True)})
+
+    @container.use_container
+    def lookup(registry: Registry) -> Registry:
+        return registry
+
+    with pytest.raises(ValueError, match="Circular dependency: Registry is required while being built"):
+        lookup()
+
+
+def test_string_annotations_match_class_keys_by_name():
+    container = Container({Repo: DIConf(cls_=Repo), Service: DIConf(cls_=Service)})
+
+    @container.use_container
+    def handle(service: "Service"):
+        return service
+
+    assert isinstance(handle().repo, Repo)
+
+
+def test_string_annotation_matching_several_class_keys_is_rejected():
+    first, second = types.ModuleType("first"), types.ModuleType("second")
+    exec("class Client:\n    pass", first.__dict__)
+    exec("class Client:\n    pass", second.__dict__)
+    container = Container({first.Client: DIConf(cls_=first.Client), second.Client: DIConf(cls_=second.Client)})
+
+    def handle(client: "Client"):
+        return client
+
+    with pytest.raises(ValueError, match="Ambiguous annotation 'Client'"):
+        container.use_container(handle)